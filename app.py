@@ -1,12 +1,22 @@
 import os
+import time
+import types
+import queue
+import atexit
 import logging
+import threading
 import traceback
 from datetime import datetime, date
+from typing import Optional
 
 from flask import (
-    Flask, render_template, request, redirect, url_for, flash, jsonify
+    Flask, Response, render_template, request, redirect, url_for, flash,
+    stream_with_context
 )
 from flask_sqlalchemy import SQLAlchemy
+import orjson
+from sqlalchemy import and_, bindparam, event, or_, text
+from sqlalchemy.schema import CreateIndex
 
 # --- Configuration & Initialization ---
 app = Flask(__name__)
@@ -35,11 +45,49 @@ if not logger.handlers:
 
 # --- Constants ---
 DEFAULT_SLOTS = ['08:00', '09:00', '10:00', '11:00', '12:00', '13:00', '14:00', '15:00', '16:00']
-SERVICE_PRICES = {'basic': 15.0, 'deluxe': 30.0, 'royal': 50.0}
+_DEFAULT_SLOTS_TUPLE = tuple(DEFAULT_SLOTS)
+SERVICE_PRICES = types.MappingProxyType({'basic': 15.0, 'deluxe': 30.0, 'royal': 50.0})
+SLOTS_CACHE_TTL = 30.0  # seconds
+SLOTS_CACHE_MAX = 1024  # dates
+BOOKINGS_PAGE_MAX = 500
+CONTACT = {
+    'phone': '76716978',
+    'email': 'royalrinse07@gmail.com',
+    'location': 'Mbabane (Sidwashini)'
+}
+SQLITE_MMAP_SIZE = 64 * 1024 * 1024  # bytes
+REJECT_BATCH_SIZE = 50
+REJECT_FLUSH_INTERVAL = 0.2  # seconds
+REJECT_SAVE_ATTEMPTS = 3
+REJECT_RETRY_DELAY = 0.5  # seconds, multiplied by the attempt number
+
+# --- Slot Cache ---
+# Maps an ISO date string to (expiry timestamp, available slots). Entries are
+# kept in insertion order, which with a fixed TTL is also expiry order.
+_SLOTS_CACHE: dict[str, tuple[float, list[str]]] = {}
+# Maps an ISO date string to the number of times its entry was invalidated.
+# Only accepted bookings bump it, so it grows with the bookings table.
+_SLOTS_GENERATION: dict[str, int] = {}
+_SLOTS_CACHE_LOCK = threading.Lock()
+
+# [current year, monotonic time at which to recompute it]
+_YEAR_CACHE = [0, 0.0]
+
+# --- Rejected Booking Writer ---
+# Rejected bookings are only kept for the record, so they are saved in batches
+# by a background thread instead of making the customer wait on a commit.
+_REJECT_QUEUE: queue.Queue = queue.Queue(maxsize=1024)
+_REJECT_WRITER: Optional[threading.Thread] = None
+_REJECT_WRITER_LOCK = threading.Lock()
 
 # --- Database Model ---
 class Booking(db.Model):
     """Database model for a car wash booking."""
+    # Serves the per-day lookups of accepted bookings, already ordered by time
+    __table_args__ = (
+        db.Index('ix_booking_date_status_time', 'date', 'status', 'time'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     customer_name = db.Column(db.String(140), nullable=False)
     phone = db.Column(db.String(60))
@@ -55,11 +103,97 @@ class Booking(db.Model):
     def __repr__(self):
         return f"<Booking {self.id}: {self.date} {self.time} - {self.customer_name}>"
 
+def _set_sqlite_pragmas(dbapi_conn, connection_record):
+    """
+    Lets readers run alongside writers, avoids an fsync on every commit and
+    reads the database file through a memory map.
+    """
+    cursor = dbapi_conn.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute(f'PRAGMA mmap_size={SQLITE_MMAP_SIZE}')
+    cursor.close()
+
 # Create database tables if they don't exist
 with app.app_context():
-    db.create_all()
+    # Register before anything connects so every pooled connection is configured
+    event.listen(db.engine, 'connect', _set_sqlite_pragmas)
+    # Every server worker runs this at startup. BEGIN IMMEDIATE takes SQLite's
+    # write lock up front, so the workers create the schema one at a time and
+    # each sees what the previous one created.
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+        db.metadata.create_all(conn)
+        # create_all() skips existing tables, so add any missing indexes explicitly
+        for index in Booking.__table__.indexes:
+            conn.execute(CreateIndex(index, if_not_exists=True))
+        conn.commit()
+
+# --- SQL Statements ---
+# Prebuilt once so hot paths skip statement construction on every call
+TAKEN_SLOTS_SQL = text(
+    "SELECT time FROM booking WHERE date = :date AND status = 'accepted'"
+).bindparams(bindparam('date', type_=db.Date))
+
+# Bookings are only ever inserted, so the highest id identifies the current
+# contents of the table. max() on the rowid is a single lookup, not a scan.
+BOOKINGS_VERSION_SQL = text('SELECT coalesce(max(id), 0) FROM booking')
+
+# Inserts an accepted booking only if its slot is still free. Running the check
+# and the insert as one statement keeps concurrent requests from both winning.
+ACCEPT_BOOKING_SQL = text("""
+    INSERT INTO booking
+        (customer_name, phone, service, date, time, address, notes, status, created_at, amount)
+    SELECT :customer_name, :phone, :service, :date, :time, :address, :notes,
+           'accepted', :created_at, :amount
+    WHERE NOT EXISTS (
+        SELECT 1 FROM booking
+        WHERE date = :date AND time = :time AND status = 'accepted'
+    )
+""").bindparams(
+    bindparam('date', type_=db.Date),
+    bindparam('created_at', type_=db.DateTime),
+)
 
 # --- Helper Functions ---
+def json_response(obj) -> Response:
+    """Serializes 'obj' with orjson into an application/json response."""
+    return Response(orjson.dumps(obj), mimetype='application/json')
+
+def _parse_ymd(s: str) -> date:
+    """
+    Parses a 'YYYY-MM-DD' string into a date, a faster equivalent of
+    datetime.strptime(s, '%Y-%m-%d').date() for this fixed format.
+
+    Raises:
+        ValueError: If 's' is not a valid date in that format.
+    """
+    if (len(s) != 10 or s[4] != '-' or s[7] != '-' or not s.isascii()
+            or not (s[0:4] + s[5:7] + s[8:10]).isdigit()):
+        raise ValueError(f'Invalid date: {s!r}')
+    return date(int(s[0:4]), int(s[5:7]), int(s[8:10]))
+
+def _store_slots(key: str, generation: int, expiry: float, slots: list[str]) -> None:
+    """
+    Caches 'slots' for 'key', dropping expired entries and, once the cache is
+    full, the oldest ones. Any date can be requested, so the size stays bounded.
+
+    Nothing is stored if 'key' was invalidated since 'generation' was read, as
+    'slots' may then predate the booking that caused the invalidation.
+    """
+    with _SLOTS_CACHE_LOCK:
+        if _SLOTS_GENERATION.get(key, 0) != generation:
+            return
+        _SLOTS_CACHE.pop(key, None)
+        now = time.monotonic()
+        while _SLOTS_CACHE:
+            oldest = next(iter(_SLOTS_CACHE))
+            if _SLOTS_CACHE[oldest][0] > now and len(_SLOTS_CACHE) < SLOTS_CACHE_MAX:
+                break
+            del _SLOTS_CACHE[oldest]
+        _SLOTS_CACHE[key] = (expiry, slots)
+
 def available_slots_for(d: date) -> list[str]:
     """
     Computes available time slots for a given date 'd'.
@@ -71,31 +205,115 @@ def available_slots_for(d: date) -> list[str]:
         A list of available time slot strings.
     """
     if d is None:
-        return DEFAULT_SLOTS.copy()
+        return list(_DEFAULT_SLOTS_TUPLE)
+
+    key = d.isoformat()
+    now = time.monotonic()
+    with _SLOTS_CACHE_LOCK:
+        cached = _SLOTS_CACHE.get(key)
+        generation = _SLOTS_GENERATION.get(key, 0)
+    if cached and cached[0] > now:
+        return cached[1].copy()
 
     try:
-        # Find all accepted bookings for the specific date
-        taken = [
-            b.time for b in Booking.query.filter_by(date=d, status='accepted').all()
-        ]
-        # Return slots that are NOT in the taken list
-        return [s for s in DEFAULT_SLOTS if s not in taken]
+        # Fetch only the time column of accepted bookings for the date
+        taken = frozenset(db.session.execute(TAKEN_SLOTS_SQL, {'date': d}).scalars())
+        # Return slots that are NOT in the taken set
+        slots = [s for s in _DEFAULT_SLOTS_TUPLE if s not in taken]
+        _store_slots(key, generation, now + SLOTS_CACHE_TTL, slots)
+        return slots.copy()
     except Exception:
         logger.error('Error computing slots: %s', traceback.format_exc())
-        return DEFAULT_SLOTS.copy()
+        return list(_DEFAULT_SLOTS_TUPLE)
+
+def invalidate_slots_for(d: date) -> None:
+    """Drops the cached available slots for date 'd'."""
+    key = d.isoformat()
+    with _SLOTS_CACHE_LOCK:
+        _SLOTS_CACHE.pop(key, None)
+        _SLOTS_GENERATION[key] = _SLOTS_GENERATION.get(key, 0) + 1
+
+def _save_rejected(rows: list[dict]) -> None:
+    """Inserts rejected booking rows and commits them in one transaction."""
+    with app.app_context():
+        db.session.execute(Booking.__table__.insert(), rows)
+        db.session.commit()
+
+def _save_rejected_with_retry(rows: list[dict]) -> None:
+    """
+    Saves a batch of rejected bookings, retrying transient failures such as
+    'database is locked'. The batch is logged as lost if every attempt fails.
+    """
+    for attempt in range(1, REJECT_SAVE_ATTEMPTS + 1):
+        try:
+            _save_rejected(rows)
+            return
+        except Exception:
+            if attempt == REJECT_SAVE_ATTEMPTS:
+                logger.error(
+                    'Lost %d rejected bookings after %d attempts: %s',
+                    len(rows), attempt, traceback.format_exc()
+                )
+                return
+            logger.warning(
+                'Error saving %d rejected bookings (attempt %d of %d), retrying: %s',
+                len(rows), attempt, REJECT_SAVE_ATTEMPTS, traceback.format_exc()
+            )
+            time.sleep(REJECT_RETRY_DELAY * attempt)
+
+def _reject_writer() -> None:
+    """Saves queued rejected bookings, up to one batch per flush interval."""
+    while True:
+        rows = [_REJECT_QUEUE.get()]
+        deadline = time.monotonic() + REJECT_FLUSH_INTERVAL
+        while len(rows) < REJECT_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                rows.append(_REJECT_QUEUE.get(timeout=remaining))
+            except queue.Empty:
+                break
+        try:
+            _save_rejected_with_retry(rows)
+        finally:
+            for _ in rows:
+                _REJECT_QUEUE.task_done()
+
+def record_rejected(row: dict) -> None:
+    """
+    Queues a rejected booking to be saved in the background.
+
+    The writer thread is started on first use, so each worker process forked
+    by the server gets its own. If the queue is full, the row is saved inline;
+    a failure there is logged rather than failing the customer's request.
+    """
+    global _REJECT_WRITER
+    with _REJECT_WRITER_LOCK:
+        if _REJECT_WRITER is None or not _REJECT_WRITER.is_alive():
+            _REJECT_WRITER = threading.Thread(
+                target=_reject_writer, name='reject-writer', daemon=True
+            )
+            _REJECT_WRITER.start()
+    try:
+        _REJECT_QUEUE.put_nowait(row)
+    except queue.Full:
+        _save_rejected_with_retry([row])
+
+# Flush queued rejected bookings before the process exits
+atexit.register(_REJECT_QUEUE.join)
 
 # --- Context Processors ---
 @app.context_processor
 def inject_common():
     """Injects common variables into all templates."""
-    contact = {
-        'phone': '76716978',
-        'email': 'royalrinse07@gmail.com',
-        'location': 'Mbabane (Sidwashini)'
-    }
+    now = time.monotonic()
+    if now >= _YEAR_CACHE[1]:
+        # Refresh the year at most once an hour
+        _YEAR_CACHE[:] = [datetime.utcnow().year, now + 3600]
     return {
-        'current_year': datetime.utcnow().year,
-        'contact': contact
+        'current_year': _YEAR_CACHE[0],
+        'contact': CONTACT
     }
 
 # --- Routes ---
@@ -120,7 +338,7 @@ def book():
     if request.method == 'POST':
         name = request.form.get('customer_name')
         phone = request.form.get('phone')
-        service = request.form.get('service') or 'basic'
+        service = request.form.get('service', 'basic')
         date_str = request.form.get('date')
         time_slot = request.form.get('time')
         address = request.form.get('address')
@@ -133,43 +351,43 @@ def book():
 
         # 2. Date format validation
         try:
-            d = datetime.strptime(date_str, '%Y-%m-%d').date()
+            d = _parse_ymd(date_str)
         except ValueError:
             message = ('error', 'Invalid date format.')
             return render_template('book.html', message=message)
-        
-        # 3. Time slot validation (Check for prior acceptance)
-        occupied = Booking.query.filter_by(
-            date=d, time=time_slot, status='accepted'
-        ).first()
-        
-        # Determine the price
-        price = SERVICE_PRICES.get(service, 15.0)
-
-        # Prepare the new booking object
-        new_booking = Booking(
-            customer_name=name,
-            phone=phone,
-            service=service,
-            date=d,
-            time=time_slot,
-            address=address,
-            notes=notes,
-            amount=price
-        )
-
-        if occupied:
-            # 4. Reject and log the rejected booking
-            new_booking.status = 'rejected'
-            db.session.add(new_booking)
-            db.session.commit()
+
+        # 3. Service validation (also determines the price)
+        price = SERVICE_PRICES.get(service)
+        if price is None:
+            message = ('error', 'Unknown service.')
+            return render_template('book.html', message=message)
+
+        booking = {
+            'customer_name': name,
+            'phone': phone,
+            'service': service,
+            'date': d,
+            'time': time_slot,
+            'address': address,
+            'notes': notes,
+            'created_at': datetime.utcnow(),
+            'amount': price
+        }
+
+        # 4. Accept the booking unless the time slot is already taken
+        result = db.session.execute(ACCEPT_BOOKING_SQL, booking)
+
+        if result.rowcount == 0:
+            # 5. Reject and log the rejected booking. Nothing was inserted,
+            # so end the transaction and leave the write to the background.
+            db.session.rollback()
+            record_rejected(dict(booking, status='rejected'))
             logger.warning("Rejected booking for %s on %s at %s. Slot taken.", name, d, time_slot)
             message = ('reject', f'Timeslot **{time_slot}** on **{d}** is already taken — booking rejected. Please choose another slot.')
         else:
-            # 5. Accept and log the accepted booking
-            new_booking.status = 'accepted'
-            db.session.add(new_booking)
+            # 6. Commit and log the accepted booking
             db.session.commit()
+            invalidate_slots_for(d)
             logger.info("Accepted booking for %s on %s at %s.", name, d, time_slot)
             message = ('accept', f'✅ Booking accepted for **{time_slot}** on **{d}**. We look forward to seeing you!')
 
@@ -185,15 +403,18 @@ def api_slots():
     
     if not date_str:
         # Return default slots if no date is provided
-        return jsonify({'slots': available_slots_for(None)})
+        return json_response({'slots': available_slots_for(None)})
     
     try:
-        d = datetime.strptime(date_str, '%Y-%m-%d').date()
+        d = _parse_ymd(date_str)
     except ValueError:
         # Return an empty list for invalid date strings
-        return jsonify({'slots': []})
+        return json_response({'slots': []})
         
-    return jsonify({'slots': available_slots_for(d)})
+    # Let pollers revalidate with If-None-Match and get a bodiless 304
+    response = json_response({'slots': available_slots_for(d)})
+    response.add_etag()
+    return response.make_conditional(request)
 
 @app.route('/schedule')
 def schedule():
@@ -203,15 +424,18 @@ def schedule():
     try:
         # Attempt to parse the date from the query parameter
         if date_str:
-            selected = datetime.strptime(date_str, '%Y-%m-%d').date()
+            selected = _parse_ymd(date_str)
         else:
             selected = date.today()
     except ValueError:
         # Fallback to today's date on error
         selected = date.today()
         
-    # Retrieve accepted bookings for the selected date, ordered by time
-    bookings = Booking.query.filter_by(
+    # Retrieve accepted bookings for the selected date, ordered by time.
+    # Only the columns shown in the schedule are loaded, as plain rows.
+    bookings = db.session.query(
+        Booking.time, Booking.customer_name, Booking.service, Booking.address
+    ).filter_by(
         date=selected, status='accepted'
     ).order_by(Booking.time).all()
     
@@ -219,21 +443,79 @@ def schedule():
 
 @app.route('/bookings.json')
 def bookings_json():
-    """API endpoint to get all bookings in JSON format."""
-    all_b = Booking.query.order_by(Booking.date.desc(), Booking.time).all()
-    
-    bookings_list = [{
-        'id': b.id,
-        'customer_name': b.customer_name,
-        'phone': b.phone,
-        'date': b.date.isoformat() if b.date else None,
-        'time': b.time,
-        'service': b.service,
-        'status': b.status,
-        'amount': b.amount
-    } for b in all_b]
-    
-    return jsonify(bookings_list)
+    """
+    API endpoint to get bookings in JSON format, newest date first.
+
+    Supports keyset pagination: 'limit' caps the page size, and passing the
+    last booking of the previous page as 'before_date', 'before_time' and
+    'before_id' continues the listing after it. Without 'limit', all
+    bookings are returned. Responses carry an ETag that changes whenever a
+    booking is added, and a matching If-None-Match gets a 304.
+    """
+    # Answer revalidation from the table version before touching any rows
+    etag = str(db.session.execute(BOOKINGS_VERSION_SQL).scalar_one())
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    limit = request.args.get('limit', type=int)
+    before_date = request.args.get('before_date')
+    before_time = request.args.get('before_time')
+    before_id = request.args.get('before_id', type=int)
+
+    query = Booking.query.with_entities(
+        Booking.id, Booking.customer_name, Booking.phone, Booking.date,
+        Booking.time, Booking.service, Booking.status, Booking.amount
+    ).order_by(Booking.date.desc(), Booking.time, Booking.id)
+
+    if before_date:
+        try:
+            cursor_date = _parse_ymd(before_date)
+        except ValueError:
+            # Return an empty list for invalid cursors
+            return json_response([])
+        cursor_time = before_time or ''
+        cursor_id = before_id or 0
+        query = query.filter(or_(
+            Booking.date < cursor_date,
+            and_(Booking.date == cursor_date, or_(
+                Booking.time > cursor_time,
+                and_(Booking.time == cursor_time, Booking.id > cursor_id)
+            ))
+        ))
+
+    if limit is not None:
+        query = query.limit(max(1, min(limit, BOOKINGS_PAGE_MAX)))
+
+    def generate():
+        # Emit one booking at a time, fetching rows in batches, rather than
+        # building the whole list
+        yield b'['
+        for i, b in enumerate(query.yield_per(500)):
+            if i:
+                yield b','
+            yield orjson.dumps({
+                'id': b.id,
+                'customer_name': b.customer_name,
+                'phone': b.phone,
+                'date': b.date,
+                'time': b.time,
+                'service': b.service,
+                'status': b.status,
+                'amount': b.amount
+            })
+        yield b']'
+
+    response = Response(stream_with_context(generate()), mimetype='application/json')
+    response.set_etag(etag)
+    return response
+
+# --- Template Warm-up ---
+# Compile every template at startup. Outside debug mode Jinja does not re-check
+# the files, so renders are served from the compiled template cache.
+for template_name in app.jinja_env.list_templates():
+    app.jinja_env.get_template(template_name)
 
 # --- Run Application ---
 if __name__ == '__main__':
@@ -0,0 +1,2 @@
+"""WSGI entry point for production servers (see Procfile)."""
+from app import app